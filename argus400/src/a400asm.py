@@ -42,6 +42,9 @@ OPTIONAL SWITCHES ::
   -z, --size                     sets the number of bytes to be written out (must
                                  be even)
 
+  -y, --symbols  <filename>      write the code and data labels with their addresses
+                                 to a symbol file for use by a400emu
+
   -h --help                      print this help message
 
   If no output filename is provided the assembler just produces the normal
@@ -63,7 +66,7 @@ header_text = '''
 import sys, re, codecs, getopt
 
 # globals
-(errors, warnings, nextmnum) = ( [],[],0)
+(errors, warnings, nextmnum, labels) = ( [],[],0,{})
 
 def usage():
     print (__doc__);
@@ -100,7 +103,7 @@ def preprocess( filename ) :
     return newtext
 
 def assemble( filename, listingon=True):
-    global errors, warnings, nextmnum
+    global errors, warnings, nextmnum, labels
 
     #op = "ld  ldm add sub ldc ldmc addc subc sto stom madd msub swap and xor or  jpz jpnz jpge jplt jpovr jpbusy out jp  asr asl lsr rol halt none1d mul div".split()
     op =  "ldx nlx add sub ldc lmc  adc  sbc  sto stn  ads  ssb  exc  and neq orf jze jnz  jge  jlt  ovr   jbs    out jcs sra sla srl slc sll  slv    mpy div".split()
@@ -119,6 +122,8 @@ def assemble( filename, listingon=True):
                 errors = (errors + ["Error: Symbol %16s redefined in ...\n         %s" % (label,line.strip())]) if label in symtab else errors
                 try:
                     exec ("%s= int(%s)" % ((label,str(nextmem)) if label!= None else (opfields[0], opfields[1])), globals(), symtab )
+                    if label != None:
+                        labels[label] = nextmem  # code/data labels only, not EQU constants
                 except:
                     errors += [ "Syntax error on:\n  %s" % line.strip() ]
                     continue
@@ -196,19 +201,20 @@ def assemble( filename, listingon=True):
     return wordmem
 
 
-if __name__ == "__main__":
+def main( argv ):
     """
     Command line option parsing.
     """
     filename = ""
     hexfile = ""
     output_filename = ""
+    symbol_filename = ""
     output_format = "hex"
     listingon = True
     start_adr = 0
     size = 0
     try:
-        opts, args = getopt.getopt( sys.argv[1:], "f:o:g:s:z:hn", ["filename=","output=","format=","start_adr=","size=","help","nolisting"])
+        opts, args = getopt.getopt( argv, "f:o:g:s:z:y:hn", ["filename=","output=","format=","start_adr=","size=","symbols=","help","nolisting"])
     except getopt.GetoptError as  err:
         print(err)
         usage()
@@ -228,6 +234,8 @@ if __name__ == "__main__":
             start_adr = int(arg,0)
         elif opt in ( "-z", "--size" ) :
             size = int(arg,0)
+        elif opt in ( "-y", "--symbols" ) :
+            symbol_filename = arg
         elif opt in ( "-g", "--format" ) :
             if (arg in ("hex", "bin")):
                 output_format = arg
@@ -258,6 +266,12 @@ if __name__ == "__main__":
                         bytes.append( (w>>8) & 0xFF)
                         bytes.append( (w>>16) & 0xFF)
                         f.write(bytes)
+        if len(errors)==0 and symbol_filename != "":
+            with open(symbol_filename,"w" ) as f:
+                f.write( ''.join(["%-28s 0x%04x\n" % (k,v) for (k,v) in sorted(labels.items(), key=lambda x: (x[1],x[0]))]))
     else:
         usage()
     sys.exit( len(errors)>0)
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
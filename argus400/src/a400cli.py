@@ -0,0 +1,143 @@
+#!/usr/bin/env -S python3 -S -E
+## ============================================================================
+## a400cli.py - thin client for the a400srv assembler/emulator server
+##
+## This file is part of the Ferranti Argus project: http://revaldinho.github.io/ferranti-argus
+##
+## This program is free software: you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## See  <http://www.gnu.org/licenses/> for a copy of the GNU Lesser General
+## Public License
+## ============================================================================
+'''
+USAGE:
+
+  a400cli [-S <path>] asm|emu <switches>
+
+  a400cli passes an a400asm or a400emu command line to a running a400srv
+  server, copies the job's stdout and stderr to its own as they arrive and
+  exits with the status of the job. All a400asm and a400emu switches are
+  accepted unchanged.
+
+  The client is kept cheap to start: run it with python3 -S -E (as the #! line
+  does) and it imports only the C socket and JSON helpers.
+
+OPTIONAL SWITCHES ::
+
+  -S --socket    <path>          specify the Unix socket path
+                                 - default is $A400_SOCKET, or a400srv.sock in
+                                   $XDG_RUNTIME_DIR or in /tmp/a400srv-<uid>, which
+                                   must belong to you and be closed to other users
+
+  -h --help                      print this help message
+
+EXAMPLES ::
+
+  python3 -S -E a400cli.py asm -f test.asm -o test.hex -n
+  python3 -S -E a400cli.py emu -f test.hex -n
+
+'''
+import sys, os, stat, _socket
+
+# The C accelerators avoid importing the json and socket packages at startup
+try:
+    from _json import scanstring, encode_basestring_ascii as quote
+except ImportError:
+    from json.decoder import scanstring
+    from json.encoder import encode_basestring_ascii as quote
+
+def usage():
+    print (__doc__);
+    sys.exit(1)
+
+def check_private_dir ( path ) :
+    # Refuse a default directory that another user could have created or can write to,
+    # as whoever listens there receives our command line and working directory
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or (st.st_mode & 0o077) != 0:
+        print ( "Error - %s must be a directory owned by you and closed to other users" % path )
+        sys.exit(1)
+
+def default_socket():
+    if "A400_SOCKET" in os.environ:
+        return os.environ["A400_SOCKET"]
+    sockdir = os.environ.get("XDG_RUNTIME_DIR") or ("/tmp/a400srv-%d" % os.getuid())
+    check_private_dir(sockdir)
+    return os.path.join(sockdir, "a400srv.sock")
+
+def message ( line ) :
+    # Server messages are single key JSON objects, {"out"|"err": <string>} or {"exit": <int>}
+    (key, end) = scanstring( line, line.index('"') + 1 )
+    value = line[end:].lstrip(": ")
+    if value.startswith('"'):
+        return ( key, scanstring(value, 1)[0] )
+    return ( key, int(value.rstrip("} \n")) )
+
+def run ( path, tool, argv ) :
+    status = 1
+    s = _socket.socket( _socket.AF_UNIX, _socket.SOCK_STREAM )
+    try:
+        s.connect(path)
+        s.sendall( ( '{"tool": %s, "argv": [%s], "cwd": %s}\n' % ( quote(tool), ", ".join([ quote(a) for a in argv ]), quote(os.getcwd()) ) ).encode() )
+        buf = b""
+        while True:
+            data = s.recv(65536)
+            if not data:
+                break
+            lines = (buf + data).split(b"\n")
+            buf = lines.pop()
+            for line in lines:
+                (key, value) = message( line.decode("ascii") )
+                if key == "out":
+                    sys.stdout.write(value)
+                    sys.stdout.flush()
+                elif key == "err":
+                    sys.stderr.write(value)
+                    sys.stderr.flush()
+                elif key == "exit":
+                    return value
+    except (FileNotFoundError, ConnectionRefusedError):
+        print ( "Error - no a400srv server listening on %s" % path )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+    return status
+
+def main ( argv ) :
+    """
+    Command line option parsing. Only the leading client switches are parsed here,
+    everything after the tool name is passed on to the server untouched. getopt is
+    not used as importing it pulls in gettext and re.
+    """
+    path = ""
+    while len(argv) > 0 and argv[0].startswith("-"):
+        opt = argv.pop(0)
+        if opt in ( "-S", "--socket" ) and len(argv) > 0:
+            path = argv.pop(0)
+        elif opt.startswith("--socket="):
+            path = opt[len("--socket="):]
+        elif opt in ("-h", "--help" ) :
+            usage()
+        else:
+            print ( "option %s not recognized" % opt )
+            usage()
+
+    if len(argv) >= 1 and argv[0] in ("asm", "emu"):
+        sys.exit( run( path or default_socket(), argv[0], argv[1:] ) )
+    else:
+        usage()
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
@@ -37,18 +37,38 @@ OPTIONAL SWITCHES ::
   -5 --500                       emulate Argus 500 instructions and print an instruction
                                  timing summary at the end of emulation (default)
 
+  -p --profile   <prefix>        count store reads, writes and executions per word
+                                 and the instruction mix per opcode and addressing
+                                 mode, and write them to <prefix>.json, <prefix>.csv
+                                 and <prefix>.txt
+
+  -y --symbols   <filename>      read a symbol file written by a400asm -y so that the
+                                 profile summary is grouped by assembler label
+
+  -i --max_instr <n>             stop after executing n instructions
+
+  -t --max_time  <seconds>       stop after emulating for the given wall-clock time
+
+  -r --progress  <seconds>       report emulated instructions/sec and simulated
+                                 Argus 400 time on stderr at (about) this interval
+
+  Budgets and progress are checked once every block of instructions rather than on
+  every step. The values for -i, -t and -r must be greater than zero. A run stopped
+  by a budget prints a machine state dump and exits with status 2.
+
   -h --help                      print this help message
 
 EXAMPLES :
 
   python3 a400asm.py -f test.hex
 
+  python3 a400emu.py -f test.hex -n -i 50000000 -t 600 -r 10
+
 '''
-from functools import reduce
-from operator import add
+import sys, getopt, time
 
-import sys, re, getopt
-import datetime
+import a400prof
+from a400prof import OPD, ACC
 
 op = {
     "ldx":0x0, "nlx":0x1, "add":0x2, "sub":0x3,
@@ -62,6 +82,54 @@ op = {
     "mpy":0x1e, "div": 0x1f
 }
 
+# Reverse opcode table and register addresses, built once at import time
+dis = dict( [ (op[k],k) for k in op ] )
+reg = {"Z":0x0000, "R":0x0001, "Q":0x0002, "C":0x003, "HSW":0x0004,
+       "INPUT":0x1000, "LINK":0x1008, "INT":0x1010}
+
+# Number of instructions emulated between checks of the budgets and progress timer
+check_interval = 4096
+
+# Operand addresses in this range are treated as IO for timing and profiling
+(io_low, io_high) = (0x010, 0x1000)
+
+# Store locations read and written by each instruction, as ( reads, writes ) tuples of
+# a400prof location codes: OPD is the (modified) operand address, ACC the accumulator
+(CARRY, QREG) = (reg["C"], reg["Q"])
+mem_access = { op["ldx"] : ( (OPD,),               (ACC,)        ),
+               op["nlx"] : ( (OPD,),               (ACC,CARRY)   ),
+               op["add"] : ( (OPD,ACC),            (ACC,CARRY)   ),
+               op["sub"] : ( (OPD,ACC),            (ACC,CARRY)   ),
+               op["ldc"] : ( (),                   (ACC,)        ),
+               op["lmc"] : ( (),                   (ACC,CARRY)   ),
+               op["adc"] : ( (ACC,),               (ACC,CARRY)   ),
+               op["sbc"] : ( (ACC,),               (ACC,CARRY)   ),
+               op["sto"] : ( (ACC,),               (OPD,)        ),
+               op["stn"] : ( (ACC,),               (OPD,CARRY)   ),
+               op["ads"] : ( (OPD,ACC),            (OPD,CARRY)   ),
+               op["ssb"] : ( (OPD,ACC),            (OPD,CARRY)   ),
+               op["exc"] : ( (OPD,ACC),            (OPD,ACC)     ),
+               op["and"] : ( (OPD,ACC),            (ACC,)        ),
+               op["neq"] : ( (OPD,ACC),            (ACC,)        ),
+               op["orf"] : ( (OPD,ACC),            (ACC,)        ),
+               op["jze"] : ( (ACC,),               ()            ),
+               op["jnz"] : ( (ACC,),               ()            ),
+               op["jge"] : ( (ACC,),               ()            ),
+               op["jlt"] : ( (ACC,),               ()            ),
+               op["ovr"] : ( (),                   ()            ),
+               op["jbs"] : ( (),                   ()            ),
+               op["out"] : ( (ACC,),               ()            ),
+               op["jcs"] : ( (OPD,),               ()            ),
+               op["sra"] : ( (ACC,QREG),           (ACC,QREG)    ),
+               op["sla"] : ( (ACC,),               (ACC,)        ),
+               op["srl"] : ( (ACC,QREG),           (ACC,QREG)    ),
+               op["slc"] : ( (ACC,),               (ACC,)        ),
+               op["sll"] : ( (),                   ()            ),
+               op["slv"] : ( (),                   ()            ),
+               op["mpy"] : ( (OPD,ACC),            (ACC,QREG)    ),
+               op["div"] : ( (OPD,ACC,QREG),       (ACC,QREG)    ),
+              }
+
 model_id = ("Argus 400", "Argus 500 Series 1, Model 1", "Argus 500 Series 2, Model 2", "Argus 500 Series 3, Model 1", "Argus 500 Series 4, Model 2")
 # A500 Instruction times per model taken from Argus 500 training manual
 # A400 instruction timings are not available yet, so for now these are taken from Argus 500 S1M1 machine (which should share the same 4Mhz clock) and then
@@ -132,6 +200,21 @@ def exec_time_us ( opcode, operand, modifier, io_low, io_high, memstore ) :
                 t_us[i] += perbit_alu_timing_us[i] * 24 * 24
     return t_us
 
+# Argus 400 time per opcode excluding the operand dependent IO, modifier and shift terms, taken
+# from exec_time_us() (operand 0, empty IO range) so that the two always agree
+a400_base_timing_us = dict( [ (k, exec_time_us( k, 0, 0, 1, 0, None )[0]) for k in base_timing_us ] )
+
+def exec_time_a400_us ( opcode, operand, modifier, io_low, io_high ) :
+    # Argus 400 only version of exec_time_us(), for progress reporting on the non-500 models
+    t_us = a400_base_timing_us[opcode]
+    if io_low <= operand <= io_high:
+        t_us += IO_inc_timing_us[0]
+    if modifier > 0:
+        t_us += modifier_timing_us[0]
+    if op["sra"] <= opcode <= op["slv"]:
+        t_us += perbit_shift_timing_us[0] * (operand % 32)
+    return t_us
+
 def print_exec_time ( t ) :
     print ( "Nominal execution times for different Argus models")
     series = 0
@@ -149,6 +232,30 @@ def print_exec_time ( t ) :
 
 
 
+def print_state ( pc, wordmem, ovr, instr_count ) :
+    instr_word = wordmem[pc] & 0xFFFFFF
+    (N, opcode, acc, mod) = ( (instr_word >> 10) & 0x3FFF, (instr_word >> 5) & 0x1F, (instr_word >> 2) & 0x7, instr_word & 0x3 )
+    print ( "Machine state after executing %d instructions" % instr_count )
+    print ( "PC   : Mem    : Instr  Reg Adr   (Mod) : C O :   R1     R2     R3     R4     R5     R6     R7   :    Q")
+    print ( "%04x : %06x : %-6s r%d, %06x %s : %d %d : %s : %06x" % ( pc, instr_word, dis[opcode], acc, N, ("(r%d)"% mod) if mod>0 else "    ",
+                                                                     wordmem[reg["C"]], ovr,
+                                                                     " ".join([ "%06x" % (wordmem[i]&0xFFFFFF) for i in range( 0x1001, 0x1000+8) ] ),
+                                                                     wordmem[reg["Q"]] ))
+
+def print_progress ( instr_count, elapsed, rate, timers ) :
+    sys.stderr.write( "Progress: %d instructions in %.1f s, %.0f instructions/s, simulated %s time %.3f ms\n" % ( instr_count, elapsed, rate, model_id[0], timers[0]/1000 ) )
+    sys.stderr.flush()
+
+def positive ( opt, arg, convert ) :
+    try:
+        value = convert(arg)
+    except ValueError:
+        value = 0
+    if not value > 0:
+        print ( "option %s requires a value greater than zero, not '%s'" % (opt, arg) )
+        usage()
+    return value
+
 def usage():
     print (__doc__);
     sys.exit(1)
@@ -163,22 +270,40 @@ def readhex( filename ) :
         print ( "Error reading %s" % filename )
         sys.exit(1)
 
-def emulate ( filename, nolisting, machine ) :
-
-    dis = dict( [ (op[k],k) for k in [ x for x in op ]])
-    reg = {"Z":0x0000, "R":0x0001, "Q":0x0002, "C":0x003, "HSW":0x0004,
-           "INPUT":0x1000, "LINK":0x1008, "INT":0x1010}
+def emulate ( filename, nolisting, machine, profile=None, max_instr=0, max_time=0, progress=0 ) :
 
     wordmem = readhex( filename )
 
     timers = [0.0,0.0,0.0,0.0,0.0]
     conout = []
     (ovr, busy, pc, instr_count) = (0, 0, 0x1020, 0) # initialise machine state inc PC
+    status = 0
+
+    # Budgets and progress are only looked at every check_interval instructions (or exactly at max_instr)
+    start_time = time.monotonic()
+    (next_check, next_report, last_report, last_count) = ( min(check_interval, max_instr or check_interval), progress, 0.0, 0 )
 
     if not nolisting:
         print ("PC   : Mem    : Instr  Reg Adr   (Mod) : C O :   R1     R2     R3     R4     R5     R6     R7   :    Q")
 
     while True:
+        if instr_count >= next_check:
+            elapsed = time.monotonic() - start_time
+            if max_instr and instr_count >= max_instr:
+                print("\nStopped at 0x%04x on reaching the instruction budget of %d instructions" % (pc, max_instr) )
+                status = 2
+                break
+            if max_time and elapsed >= max_time:
+                print("\nStopped at 0x%04x on reaching the time budget of %g s after executing %d instructions" % (pc, max_time, instr_count) )
+                status = 2
+                break
+            if progress and elapsed >= next_report:
+                print_progress( instr_count, elapsed, (instr_count - last_count) / max(elapsed - last_report, 1e-9), timers )
+                (next_report, last_report, last_count) = (elapsed + progress, elapsed, instr_count)
+            next_check = instr_count + check_interval
+            if max_instr:
+                next_check = min(next_check, max_instr)
+
         instr_count += 1
         instr_word = wordmem[pc] &  0xFFFFFF
         N = (instr_word >> 10 ) & 0x03FFF
@@ -204,10 +329,15 @@ def emulate ( filename, nolisting, machine ) :
             print ("%04x :%s: %s %s : %d %d : %s : %s" % (pc, mem_str, instr_str, opreg_str, wordmem[reg["C"]], ovr, reg_str, qreg_str ))
             # print ( "MEM: " + " ".join( [ "%06x" % (wordmem[i]&0xFFFFFF) for i in range ( 0x1100, 0x1110)]))
 
+        if profile:
+            profile.record( pc, opcode, operand, acc_adr, mod )
+
         pc += 1
 
         if machine == 500:
-            timers = [ sum(i) for i in zip(timers, exec_time_us( opcode, operand, mod, 0x010, 0x1000, wordmem ) ) ]
+            timers = [ sum(i) for i in zip(timers, exec_time_us( opcode, operand, mod, io_low, io_high, wordmem ) ) ]
+        elif progress:
+            timers[0] += exec_time_a400_us( opcode, operand, mod, io_low, io_high )
 
         if opcode == op["ldx"]:
             result = wordmem[operand]
@@ -310,7 +440,7 @@ def emulate ( filename, nolisting, machine ) :
         elif opcode == op["sra"]:
             # Create 32b sign extension
             signbit = 1 if (wordmem[acc_adr]&0x800000 >0) else 0
-            sign_extension = reduce ( lambda x, y: x | y, [(2**i)*signbit for i in range (0,32)])
+            sign_extension = 0xFFFFFFFF * signbit
             double = sign_extension<<48 | wordmem[ acc_adr] << 24 | wordmem[reg["Q"]]
             result = double >> (operand & 0x01F)
             wordmem[reg["Q"]] = result & 0xFFFFFF
@@ -405,20 +535,29 @@ def emulate ( filename, nolisting, machine ) :
         else:
             print ("Error - unidentified opcode 0x%02x" % opcode)
 
+    if status != 0:
+        print_state( pc, wordmem, ovr, instr_count )
+    if progress:
+        elapsed = time.monotonic() - start_time
+        print_progress( instr_count, elapsed, instr_count / max(elapsed, 1e-9), timers )
     if machine == 500 :
         print_exec_time(timers)
     if not nolisting:
         print ( ("").join(conout) )
+    return status
 
-if __name__ == "__main__":
+def main ( argv ) :
     """
     Command line option parsing.
     """
     filename = ""
     nolisting = False
     machine = 500
+    profile_prefix = ""
+    symbol_filename = ""
+    (max_instr, max_time, progress) = (0, 0, 0)
     try:
-        opts, args = getopt.getopt( sys.argv[1:], "f:1:4:5:nh", ["filename=","100","400","500","nolisting","help"])
+        opts, args = getopt.getopt( argv, "f:1:4:5:p:y:i:t:r:nh", ["filename=","100","400","500","profile=","symbols=","max_instr=","max_time=","progress=","nolisting","help"])
     except getopt.GetoptError as  err:
         print(err)
         usage()
@@ -434,12 +573,46 @@ if __name__ == "__main__":
             machine = 400
         elif opt in ("-4", "--500" ) :
             machine = 500
+        elif opt in ("-p", "--profile" ) :
+            profile_prefix = arg
+        elif opt in ("-y", "--symbols" ) :
+            symbol_filename = arg
+        elif opt in ("-i", "--max_instr" ) :
+            max_instr = positive( opt, arg, lambda x: int(x,0) )
+        elif opt in ("-t", "--max_time" ) :
+            max_time = positive( opt, arg, float )
+        elif opt in ("-r", "--progress" ) :
+            progress = positive( opt, arg, float )
         elif opt in ("-h", "--help" ) :
             usage()
         else:
             sys.exit(1)
 
     if filename != "":
-        emulate( filename , nolisting, machine)
+        profile = None
+        if profile_prefix != "":
+            # Check the input can be read before any previous profile outputs are truncated
+            readhex( filename )
+            try:
+                symbols = a400prof.read_symbols( symbol_filename ) if symbol_filename != "" else {}
+            except (OSError, ValueError):
+                print ( "Error reading %s" % symbol_filename )
+                sys.exit(1)
+            profile = a400prof.Profile( 16384, dis, mem_access, io_low, io_high, symbols )
+            try:
+                profile.open( profile_prefix )
+            except OSError as e:
+                print ( "Error opening profile output %s.* : %s" % (profile_prefix, e.strerror) )
+                sys.exit(1)
+        try:
+            status = emulate( filename , nolisting, machine, profile, max_instr, max_time, progress )
+        finally:
+            # Keep whatever was collected even if the run ends in an error
+            if profile:
+                profile.write()
+        sys.exit(status)
     else:
         usage()
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
@@ -0,0 +1,172 @@
+## ============================================================================
+## a400prof.py - memory access and instruction mix profiling for a400emu
+##
+## This file is part of the Ferranti Argus project: http://revaldinho.github.io/ferranti-argus
+##
+## This program is free software: you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## See  <http://www.gnu.org/licenses/> for a copy of the GNU Lesser General
+## Public License
+## ============================================================================
+'''
+Opt-in profiling for the a400emu emulator.
+
+A Profile keeps one fixed size counter array per kind of store access (read,
+write, execute) plus one counter per opcode and addressing mode, so the cost
+is a handful of array increments per emulated instruction regardless of the
+length of the run.
+
+Addressing modes are counted separately for unmodified and modified (ie
+modifier != 0) operands, and for operands falling in the IO range used by
+exec_time_us().
+
+Results can be written out as JSON, as a per-word CSV heatmap and as a text
+summary grouped by the labels in an a400asm symbol file (see a400asm -y).
+'''
+from array import array
+
+import json, csv
+
+# Location codes used in the access tables: the (modified) operand address and
+# the accumulator register. Any other value is a fixed store address, eg Q or C.
+OPD = -1
+ACC = -2
+
+# Addressing mode index is (modified << 1) | io
+modes = ("unmodified", "unmodified_io", "modified", "modified_io")
+
+# Fixed regions reported when no assembler label covers an address
+store_regions = { "(low store)": 0x0000, "(registers)": 0x1000, "(program)": 0x1020 }
+
+def read_symbols ( filename ) :
+    # Symbol file lines are '<label> <address>' as written by a400asm -y
+    symbols = {}
+    with open(filename, "rt") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                symbols[fields[0]] = int(fields[1], 0)
+    return symbols
+
+class Profile :
+
+    def __init__ ( self, size, opnames, accesses, io_low, io_high, symbols=None ) :
+        # accesses maps each opcode to a ( reads, writes ) pair of location code tuples
+        self.size = size
+        self.opnames = opnames
+        self.accesses = accesses
+        (self.io_low, self.io_high) = (io_low, io_high)
+        # 64 bit counters: a hot word in a long run can pass 2^32 accesses
+        self.reads = array("Q", [0]) * size
+        self.writes = array("Q", [0]) * size
+        self.execs = array("Q", [0]) * size
+        self.mix = array("Q", [0]) * (32 * len(modes))
+        self.instr_count = 0
+        self.files = None
+        self.labels = sorted( [ (v,k) for (k,v) in dict(store_regions, **(symbols or {})).items() ] )
+
+    def record ( self, pc, opcode, operand, acc_adr, mod ) :
+        self.instr_count += 1
+        self.execs[pc] += 1
+        io = 1 if ( self.io_low <= operand <= self.io_high ) else 0
+        if mod > 0:
+            self.reads[0x1000 + mod] += 1
+            self.mix[ (opcode << 2) | 2 | io ] += 1
+        else:
+            self.mix[ (opcode << 2) | io ] += 1
+        (reads, writes) = self.accesses[opcode]
+        for loc in reads:
+            self.reads[ operand if loc == OPD else acc_adr if loc == ACC else loc ] += 1
+        for loc in writes:
+            self.writes[ operand if loc == OPD else acc_adr if loc == ACC else loc ] += 1
+
+    def words ( self ) :
+        # Yield ( address, label, reads, writes, execs ) for every word touched
+        (labels, idx, name) = (self.labels, 0, "")
+        for adr in range(0, self.size):
+            while idx < len(labels) and labels[idx][0] <= adr:
+                name = labels[idx][1]
+                idx += 1
+            if self.reads[adr] or self.writes[adr] or self.execs[adr]:
+                yield ( adr, name, self.reads[adr], self.writes[adr], self.execs[adr] )
+
+    def instruction_mix ( self ) :
+        # Yield ( opcode name, [ count per mode ] ) for every opcode executed
+        for opcode in range(0, 32):
+            counts = list( self.mix[ opcode << 2 : (opcode << 2) + len(modes) ] )
+            if sum(counts) > 0:
+                yield ( self.opnames.get(opcode, "0x%02x" % opcode), counts )
+
+    def write_json ( self, f ) :
+        data = { "instructions": self.instr_count,
+                 "io_range": [ self.io_low, self.io_high ],
+                 "words": [ dict( zip( ("address", "label", "reads", "writes", "execs"), w ) ) for w in self.words() ],
+                 "mix": [ dict( opcode=name, total=sum(counts), **dict(zip(modes, counts)) ) for (name, counts) in self.instruction_mix() ] }
+        json.dump( data, f, indent=1 )
+
+    def write_csv ( self, f ) :
+        w = csv.writer(f)
+        w.writerow( ("address", "label", "reads", "writes", "execs") )
+        for (adr, name, r, wr, x) in self.words():
+            w.writerow( ("0x%04x" % adr, name, r, wr, x) )
+
+    def summary ( self ) :
+        lines = []
+        groups = {}
+        (lowest, highest, touched) = (self.size, -1, 0)
+        for (adr, name, r, w, x) in self.words():
+            g = groups.setdefault( name, [adr, adr, 0, 0, 0, 0] )
+            g[1] = adr
+            g[2] += r
+            g[3] += w
+            g[4] += x
+            g[5] += 1
+            (lowest, highest, touched) = (min(lowest, adr), max(highest, adr), touched + 1)
+
+        lines.append( "Store usage by label")
+        lines.append( "  %-28s %-11s %6s %12s %12s %12s" % ("Label", "Range", "Words", "Reads", "Writes", "Execs") )
+        for (name, g) in sorted( groups.items(), key=lambda x: x[1][0] ):
+            lines.append( "  %-28s %04x-%04x   %6d %12d %12d %12d" % ( name, g[0], g[1], g[5], g[2], g[3], g[4] ) )
+        if touched > 0:
+            lines.append( "  %d words touched, lowest 0x%04x, highest 0x%04x" % (touched, lowest, highest) )
+
+        lines.append( "" )
+        lines.append( "Instruction mix (%d instructions, IO range 0x%03x-0x%04x)" % (self.instr_count, self.io_low, self.io_high) )
+        lines.append( "  %-6s %12s %7s %12s %12s %12s %12s" % ("Opcode", "Total", "%", "Unmod", "Unmod IO", "Mod", "Mod IO") )
+        for (name, counts) in sorted( self.instruction_mix(), key=lambda x: -sum(x[1]) ):
+            lines.append( "  %-6s %12d %6.2f%% %12d %12d %12d %12d" % ( name, sum(counts), 100.0 * sum(counts) / max(1, self.instr_count), *counts ) )
+        return "\n".join(lines) + "\n"
+
+    def write_summary ( self, f ) :
+        f.write( self.summary() )
+
+    def open ( self, prefix ) :
+        # Open <prefix>.json, .csv and .txt before the run, so that a bad prefix is
+        # reported straight away rather than after the whole run has been thrown away
+        files = []
+        try:
+            for ext in (".json", ".csv", ".txt"):
+                files.append( open(prefix + ext, "w", newline="") )
+        except OSError:
+            for f in files:
+                f.close()
+            raise
+        self.files = files
+
+    def write ( self ) :
+        (json_f, csv_f, txt_f) = self.files
+        try:
+            self.write_json( json_f )
+            self.write_csv( csv_f )
+            self.write_summary( txt_f )
+        finally:
+            for f in self.files:
+                f.close()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+## ============================================================================
+## a400srv.py - persistent assembler/emulator server for the Ferranti Argus 400
+##
+## This file is part of the Ferranti Argus project: http://revaldinho.github.io/ferranti-argus
+##
+## This program is free software: you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## See  <http://www.gnu.org/licenses/> for a copy of the GNU Lesser General
+## Public License
+## ============================================================================
+'''
+USAGE:
+
+  a400srv is a long-lived server which runs a400asm and a400emu jobs on behalf
+  of the a400cli client, so that Python startup, module imports and the opcode
+  and timing tables are paid for once rather than on every invocation.
+
+  Each request is run in a child process forked from the warm server, so jobs
+  run concurrently and cannot disturb each other's (or the server's) state.
+  Console output is streamed back to the client as it is produced.
+
+OPTIONAL SWITCHES ::
+
+  -S --socket    <path>          specify the Unix socket path
+                                 - default is $A400_SOCKET, or a400srv.sock in
+                                   $XDG_RUNTIME_DIR or in /tmp/a400srv-<uid>
+
+  The socket is only accessible to the user running the server. The default
+  directory is created if necessary, and must belong to that user and be closed
+  to everyone else, so that another user cannot stand in for the server.
+
+  -h --help                      print this help message
+
+PROTOCOL ::
+
+  The client sends a single JSON line:
+
+    {"tool": "asm"|"emu", "argv": [<switches>], "cwd": <directory>}
+
+  and the server replies with one single-key JSON object per line: {"out": <text>}
+  and {"err": <text>} carry the job's stdout and stderr as they are produced, and
+  the final {"exit": <status>} carries its exit status. The client must keep its
+  side of the connection open until then - closing or shutting it down stops the
+  job.
+
+EXAMPLES ::
+
+  python3 a400srv.py &
+  python3 -S -E a400cli.py asm -f test.asm -o test.hex -n
+  python3 -S -E a400cli.py emu -f test.hex -n
+
+'''
+import sys, os, stat, getopt, json, asyncio, signal, socket, codecs
+
+import a400asm, a400emu
+
+tools = { "asm": a400asm.main, "emu": a400emu.main }
+
+# pids of running (or not yet reaped) jobs, and the tasks handling client connections
+children = set()
+handlers = set()
+
+def usage():
+    print (__doc__);
+    sys.exit(1)
+
+def check_private_dir ( path ) :
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or (st.st_mode & 0o077) != 0:
+        print ( "Error - %s must be a directory owned by you and closed to other users" % path )
+        sys.exit(1)
+
+def default_socket ( create=False ) :
+    if "A400_SOCKET" in os.environ:
+        return os.environ["A400_SOCKET"]
+    sockdir = os.environ.get("XDG_RUNTIME_DIR") or ("/tmp/a400srv-%d" % os.getuid())
+    if create:
+        try:
+            os.mkdir(sockdir, 0o700)
+        except FileExistsError:
+            pass
+    check_private_dir(sockdir)
+    return os.path.join(sockdir, "a400srv.sock")
+
+def run_child ( tool, argv, cwd, out_w, err_w ) :
+    # Runs in the forked child: restore default signal handling, redirect the console
+    # to the pipes, drop every other inherited fd (listening and client sockets) and run
+    # the tool's normal command line entry point, mapping its sys.exit() onto the status
+    status = 0
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        nullfd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(nullfd, 0)
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+        os.chdir(cwd)
+        tools[tool](argv)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        print ( "Error - %s" % e )
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status & 0xFF)
+
+def reap ( pid ) :
+    (_, status) = os.waitpid( pid, 0 )
+    children.discard(pid)
+    code = os.waitstatus_to_exitcode(status)
+    # Report a job killed by a signal the way a shell would, ie 128 + signal number
+    return (128 - code) if code < 0 else (code & 0xFF)
+
+def signal_child ( pid ) :
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+def stop_child ( pid ) :
+    if pid in children:
+        signal_child(pid)
+        reap(pid)
+
+async def send ( writer, msg ) :
+    writer.write( (json.dumps(msg) + "\n").encode() )
+    await writer.drain()
+
+async def relay ( pipe, key, writer ) :
+    # Decode incrementally so that multi-byte characters split across reads survive
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    while True:
+        data = await pipe.read(65536)
+        text = decoder.decode(data, final=not data)
+        if text:
+            await send( writer, {key: text} )
+        if not data:
+            break
+
+async def relay_all ( relays ) :
+    await asyncio.gather( *relays )
+
+async def client_gone ( reader ) :
+    # The client sends nothing after its request, so this only returns at EOF
+    try:
+        await reader.read()
+    except ConnectionError:
+        pass
+
+async def handle ( reader, writer ) :
+    loop = asyncio.get_running_loop()
+    handlers.add( asyncio.current_task() )
+    (pid, transports, tasks) = (None, [], [])
+    try:
+        try:
+            request = json.loads( await reader.readline() )
+            (tool, argv, cwd) = ( request["tool"], [ str(x) for x in request.get("argv", []) ], request.get("cwd", os.getcwd()) )
+            if tool not in tools:
+                raise ValueError("unknown tool '%s'" % tool)
+        except (ValueError, KeyError, TypeError) as e:
+            await send( writer, {"err": "Error - bad request: %s\n" % e} )
+            await send( writer, {"exit": 1} )
+            return
+
+        (out_r, out_w) = os.pipe()
+        (err_r, err_w) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            run_child( tool, argv, cwd, out_w, err_w )
+        children.add(pid)
+        os.close(out_w)
+        os.close(err_w)
+
+        relays = []
+        for (fd, key) in ( (out_r, "out"), (err_r, "err") ):
+            pipe = asyncio.StreamReader()
+            (transport, _) = await loop.connect_read_pipe( lambda pipe=pipe: asyncio.StreamReaderProtocol(pipe), os.fdopen(fd, "rb", 0) )
+            transports.append(transport)
+            relays.append( relay(pipe, key, writer) )
+        job = asyncio.ensure_future( relay_all(relays) )
+        watch = asyncio.ensure_future( client_gone(reader) )
+        tasks = [job, watch]
+        await asyncio.wait( tasks, return_when=asyncio.FIRST_COMPLETED )
+        if job.done() and job.exception() is None:
+            # Both pipes only reach EOF as the child exits, so this reap does not block the server
+            await send( writer, {"exit": reap(pid)} )
+        # Otherwise the client went away (or could not be written to) and the job is stopped below
+    except ConnectionError:
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+        if pid is not None:
+            stop_child(pid)
+        for t in transports:
+            t.close()
+        writer.close()
+        handlers.discard( asyncio.current_task() )
+
+def claim_socket ( path ) :
+    # Only replace a stale socket left behind by a server that has gone away
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        print ( "Error - %s exists and is not a socket" % path )
+        sys.exit(1)
+    with socket.socket( socket.AF_UNIX, socket.SOCK_STREAM ) as s:
+        try:
+            s.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    print ( "Error - another a400srv is already listening on %s" % path )
+    sys.exit(1)
+
+async def serve ( path ) :
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in ( signal.SIGTERM, signal.SIGINT ):
+        loop.add_signal_handler( sig, task.cancel )
+    claim_socket(path)
+    # Create the socket closed to other users - anyone who can connect can run jobs as us
+    old_umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server( handle, path=path )
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+    ino = os.stat(path).st_ino
+    print ( "a400srv listening on %s" % path )
+    sys.stdout.flush()
+    try:
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                # Stop any jobs still running so that they cannot outlive the server, letting
+                # their handlers report the exit status to the clients before reaping the rest
+                try:
+                    for pid in list(children):
+                        signal_child(pid)
+                    if handlers:
+                        await asyncio.wait( list(handlers), timeout=5 )
+                finally:
+                    for pid in list(children):
+                        stop_child(pid)
+    finally:
+        try:
+            if os.stat(path).st_ino == ino:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def main ( argv ) :
+    """
+    Command line option parsing.
+    """
+    path = ""
+    try:
+        opts, args = getopt.getopt( argv, "S:h", ["socket=","help"])
+    except getopt.GetoptError as  err:
+        print(err)
+        usage()
+
+    for opt, arg in opts:
+        if opt in ( "-S", "--socket" ) :
+            path = arg
+        elif opt in ("-h", "--help" ) :
+            usage()
+        else:
+            sys.exit(1)
+
+    if path == "":
+        path = default_socket( create=True )
+
+    try:
+        asyncio.run( serve(path) )
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )